@@ -1,18 +1,32 @@
 from __future__ import annotations
 
+import codecs
 import csv
 import io
 import json
 import os
+import random
+import secrets
 import sqlite3
+import threading
+import time
+import unicodedata
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
+from itertools import groupby, islice
+from typing import Iterable, Iterator
 
+import click
 from flask import (
     Flask,
     current_app,
     flash,
     g,
+    jsonify,
     make_response,
     redirect,
     render_template,
@@ -22,12 +36,34 @@ from flask import (
 )
 from werkzeug.security import check_password_hash, generate_password_hash
 
-MAX_NUMBER = 100000
+MAX_NUMBER = int(os.environ.get("MAX_NUMBER", "100000"))
 PAGE_SIZE = 10000
 RESERVE_MINUTES = 15
 DEFAULT_SECRET_KEY = "casamentoguto"
 DEFAULT_SUPERUSER_USERNAME = "guto"
 DEFAULT_SUPERUSER_PASSWORD = "casamento"
+MIN_PASSWORD_LENGTH = 6
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+SQL_CHUNK_SIZE = 500
+STREAM_CHUNK_BYTES = 65536
+MIGRATION_LOCK_TIMEOUT = 60
+BACKUP_KEEP = 24
+BACKUP_PREFIX = "raffle-"
+BACKUP_STATUS_FILE = "last_backup.json"
+MAX_PRIZES = 100
+DRAW_BUCKET_SIZE = 256
+DRAW_MAX_BUCKETS = 1024
+MAX_LOOKUP_NUMBERS = 5000
+DB_BUSY_TIMEOUT = 2.0
+WRITE_QUEUE_LIMIT = 32
+WRITE_QUEUE_TIMEOUT = 10.0
+WRITE_RETRIES = 5
+WRITE_ATTEMPT_TIMEOUT = 0.25
+WRITE_RETRY_BASE = 0.05
+WRITE_METRICS_WINDOW = 1000
+AGGREGATE_CACHE_TTL = 2.0
+ROLLUP_DEFAULT_HOURS = 48
+ROLLUP_MAX_HOURS = 24 * 14
 
 
 def now_ts() -> str:
@@ -46,10 +82,24 @@ def create_app() -> Flask:
 
     os.makedirs(app.instance_path, exist_ok=True)
     app.config["DATABASE"] = os.path.join(app.instance_path, "raffle.db")
+    app.config["BACKUP_DIR"] = os.environ.get("BACKUP_DIR") or os.path.join(
+        app.instance_path, "backups"
+    )
+    app.config["BACKUP_KEEP"] = parse_int(os.environ.get("BACKUP_KEEP"), BACKUP_KEEP)
+    app.extensions["write_scheduler"] = WriteScheduler(
+        parse_int(os.environ.get("WRITE_QUEUE_LIMIT"), WRITE_QUEUE_LIMIT),
+        WRITE_QUEUE_TIMEOUT,
+    )
+    app.extensions["aggregate_cache"] = AggregateCache(
+        float(os.environ.get("ADMIN_CACHE_TTL", AGGREGATE_CACHE_TTL))
+    )
 
     with app.app_context():
-        init_db()
-        bootstrap_superuser()
+        # On a current schema this is a single PRAGMA read. The superuser is only
+        # bootstrapped when migrations ran (e.g. a new database); otherwise use
+        # `flask bootstrap-superuser`.
+        if init_db():
+            bootstrap_superuser()
 
     @app.before_request
     def load_logged_in_user() -> None:
@@ -114,8 +164,52 @@ def create_app() -> Flask:
 
         return wrapped_view
 
+    def write_admission(view):
+        # Serializes write requests in this process through a bounded queue.
+        # When it is full, or SQLite stays locked after retries, the client
+        # gets an explicit 429 instead of a generic database error.
+        @wraps(view)
+        def wrapped_view(**kwargs):
+            if request.method == "GET":
+                return view(**kwargs)
+            scheduler = current_app.extensions["write_scheduler"]
+            try:
+                with scheduler.slot():
+                    g.write_slot = True
+                    try:
+                        return view(**kwargs)
+                    finally:
+                        current_app.extensions["aggregate_cache"].invalidate()
+            except WriteBusy as exc:
+                return write_busy_response(exc)
+            finally:
+                g.pop("write_slot", None)
+
+        return wrapped_view
+
+    def import_upload(importer, endpoint: str):
+        # Runs `importer(rows, actor_id)` on the uploaded CSV. Returns
+        # (result, None), or (None, response) when the upload was rejected.
+        upload = request.files.get("file")
+        if upload is None or not upload.filename:
+            flash("Select a CSV file to import.", "error")
+            return None, redirect(url_for(endpoint))
+
+        try:
+            return importer(read_csv_rows(upload.stream), g.user["id"]), None
+        except WriteBusy as exc:
+            return None, write_busy_response(exc)
+        except UnicodeDecodeError:
+            flash("The CSV file must be UTF-8 encoded.", "error")
+        except csv.Error as exc:
+            flash(f"The CSV file could not be read: {exc}", "error")
+        except sqlite3.Error:
+            flash("Database error. Please try again.", "error")
+        return None, redirect(url_for(endpoint))
+
     @app.route("/seller", methods=["GET", "POST"])
     @login_required
+    @write_admission
     def seller_dashboard():
         if g.user["role"] == "superuser":
             return redirect(url_for("admin_dashboard"))
@@ -128,6 +222,7 @@ def create_app() -> Flask:
             buyer_name = request.form.get("buyer_name", "").strip()
             buyer_phone = request.form.get("buyer_phone", "").strip()
             clear_selection = False
+            receipt_order_id = None
 
             error = None
             if not selected_numbers:
@@ -149,21 +244,23 @@ def create_app() -> Flask:
                     numbers.append(number)
 
             if error is None:
+                numbers = sorted(set(numbers))
+                ranges = number_ranges(numbers)
                 db = get_db()
                 try:
-                    db.execute("BEGIN IMMEDIATE")
+                    begin_write(db)
                     now = now_ts()
 
-                    if action == "reserve":
+                    sold_number = first_sold_number(db, ranges)
+                    if sold_number is not None:
+                        error = f"Number {sold_number} is already sold."
+                        db.rollback()
+
+                    elif action == "reserve":
                         reserve_until = reserve_until_ts()
+                        created: list[int] = []
+                        extended: list[int] = []
                         for number in numbers:
-                            sold = db.execute(
-                                "SELECT 1 FROM sales WHERE number = ?", (number,)
-                            ).fetchone()
-                            if sold:
-                                error = f"Number {number} is already sold."
-                                break
-
                             existing = db.execute(
                                 "SELECT seller_id FROM reservations WHERE number = ?",
                                 (number,),
@@ -174,14 +271,7 @@ def create_app() -> Flask:
                                         "UPDATE reservations SET reserved_until = ? WHERE number = ?",
                                         (reserve_until, number),
                                     )
-                                    log_audit(
-                                        "reservation_extend",
-                                        g.user["id"],
-                                        number=number,
-                                        seller_id=g.user["id"],
-                                        details={"reserved_until": reserve_until},
-                                        db=db,
-                                    )
+                                    extended.append(number)
                                 else:
                                     error = f"Number {number} is already reserved."
                                     break
@@ -191,18 +281,27 @@ def create_app() -> Flask:
                                     "VALUES (?, ?, ?, ?)",
                                     (number, g.user["id"], now, reserve_until),
                                 )
-                                log_audit(
-                                    "reservation_create",
-                                    g.user["id"],
-                                    number=number,
-                                    seller_id=g.user["id"],
-                                    details={"reserved_until": reserve_until},
-                                    db=db,
-                                )
+                                created.append(number)
 
                         if error:
                             db.rollback()
                         else:
+                            for audit_action, touched in (
+                                ("reservation_create", created),
+                                ("reservation_extend", extended),
+                            ):
+                                for range_start, range_end in number_ranges(touched):
+                                    log_audit(
+                                        audit_action,
+                                        g.user["id"],
+                                        number=range_start,
+                                        number_end=range_end,
+                                        seller_id=g.user["id"],
+                                        details={"reserved_until": reserve_until},
+                                        db=db,
+                                    )
+                            if created:
+                                record_activity(db, g.user["id"], now, reservations=len(created))
                             db.commit()
                             flash(
                                 f"Reserved {len(numbers)} number(s) for {RESERVE_MINUTES} minutes.",
@@ -211,41 +310,32 @@ def create_app() -> Flask:
                             clear_selection = True
 
                     else:
-                        for number in numbers:
-                            sold = db.execute(
-                                "SELECT 1 FROM sales WHERE number = ?", (number,)
-                            ).fetchone()
-                            if sold:
-                                error = f"Number {number} is already sold."
-                                break
-
-                            reservation = db.execute(
-                                "SELECT seller_id FROM reservations WHERE number = ?",
-                                (number,),
-                            ).fetchone()
-                            if reservation and reservation["seller_id"] != g.user["id"]:
-                                error = f"Number {number} is reserved by another seller."
-                                break
-
-                        if error:
+                        numbers_json = json.dumps(numbers)
+                        taken = db.execute(
+                            "SELECT MIN(number) FROM reservations "
+                            "WHERE seller_id != ? AND number IN (SELECT value FROM json_each(?))",
+                            (g.user["id"], numbers_json),
+                        ).fetchone()[0]
+                        if taken is not None:
+                            error = f"Number {taken} is reserved by another seller."
                             db.rollback()
                         else:
-                            for number in numbers:
-                                db.execute(
-                                    "INSERT INTO sales (number, seller_id, buyer_name, buyer_phone, sold_at) "
-                                    "VALUES (?, ?, ?, ?, ?)",
-                                    (number, g.user["id"], buyer_name, buyer_phone, now),
-                                )
-                                db.execute(
-                                    "DELETE FROM reservations WHERE number = ?",
-                                    (number,),
-                                )
+                            order_id = create_order(
+                                db, g.user["id"], buyer_name, buyer_phone, now, ranges
+                            )
+                            db.execute(
+                                "DELETE FROM reservations WHERE number IN (SELECT value FROM json_each(?))",
+                                (numbers_json,),
+                            )
+                            for range_start, range_end in ranges:
                                 log_audit(
                                     "sale_create",
                                     g.user["id"],
-                                    number=number,
+                                    number=range_start,
+                                    number_end=range_end,
                                     seller_id=g.user["id"],
                                     details={
+                                        "order_id": order_id,
                                         "buyer_name": buyer_name,
                                         "buyer_phone": buyer_phone,
                                         "sold_at": now,
@@ -253,9 +343,11 @@ def create_app() -> Flask:
                                     db=db,
                                 )
 
+                            record_activity(db, g.user["id"], now, sales=len(numbers))
                             db.commit()
                             flash(f"Sold {len(numbers)} number(s).", "success")
                             clear_selection = True
+                            receipt_order_id = order_id
 
                 except sqlite3.IntegrityError:
                     db.rollback()
@@ -269,12 +361,16 @@ def create_app() -> Flask:
 
             if error:
                 flash(error, "error")
+            if receipt_order_id is not None:
+                return redirect(
+                    url_for("seller_dashboard", clear_selection=1, receipt=receipt_order_id)
+                )
             if clear_selection:
                 return redirect(url_for("seller_dashboard", clear_selection=1))
             return redirect(url_for("seller_dashboard"))
 
         total_sold = query_value(
-            "SELECT COUNT(*) FROM sales WHERE seller_id = ?", (g.user["id"],)
+            "SELECT COALESCE(SUM(quantity), 0) FROM orders WHERE seller_id = ?", (g.user["id"],)
         )
         total_reserved = query_value(
             "SELECT COUNT(*) FROM reservations WHERE seller_id = ?", (g.user["id"],)
@@ -286,11 +382,9 @@ def create_app() -> Flask:
         start = (page - 1) * PAGE_SIZE + 1
         end = min(page * PAGE_SIZE, MAX_NUMBER)
 
-        sold_numbers = query_all(
-            "SELECT number FROM sales WHERE number BETWEEN ? AND ?",
-            (start, end),
-        )
-        sold_set = {row["number"] for row in sold_numbers}
+        sold_set = set()
+        for row in overlapping_ranges(get_db(), start, end):
+            sold_set.update(range(max(start, row["start_number"]), min(end, row["end_number"]) + 1))
 
         reservation_rows = query_all(
             "SELECT number, seller_id FROM reservations WHERE number BETWEEN ? AND ?",
@@ -317,6 +411,11 @@ def create_app() -> Flask:
             (g.user["id"],),
         )
 
+        last_receipt = None
+        receipt_order_id = parse_int(request.args.get("receipt"), None)
+        if receipt_order_id is not None:
+            last_receipt = order_receipt(get_db(), receipt_order_id, g.user["id"])
+
         return render_template(
             "seller_dashboard.html",
             total_sold=total_sold,
@@ -330,34 +429,82 @@ def create_app() -> Flask:
             max_number=MAX_NUMBER,
             my_reservations=my_reservations,
             reserve_minutes=RESERVE_MINUTES,
+            last_receipt=last_receipt,
+        )
+
+    @app.route("/numbers")
+    @login_required
+    def number_lookup():
+        query = request.args.get("q", "").strip()
+        results = []
+        error = None
+        if query:
+            try:
+                numbers = parse_number_list(query)
+            except ValueError as exc:
+                error = str(exc)
+            else:
+                cleanup_expired_reservations()
+                results = lookup_numbers(numbers)
+
+        if g.user["role"] != "superuser":
+            # Sellers see availability for every number but buyer data only
+            # for their own sales.
+            for item in results:
+                if item["seller_id"] != g.user["id"]:
+                    item["buyer_name"] = None
+                    item["buyer_phone"] = None
+
+        if request.args.get("format") == "json":
+            if error:
+                return jsonify({"error": error}), 400
+            return jsonify({"results": results})
+
+        if error:
+            flash(error, "error")
+        return render_template(
+            "number_lookup.html",
+            query=query,
+            results=results,
+            max_lookup=MAX_LOOKUP_NUMBERS,
         )
 
     @app.route("/sale/<int:number>/edit", methods=["POST"])
     @login_required
+    @write_admission
     def edit_sale(number: int):
-        sale = query_one(
-            "SELECT number, seller_id, buyer_name, buyer_phone, sold_at FROM sales WHERE number = ?",
-            (number,),
-        )
+        buyer_name = request.form.get("buyer_name", "").strip()
+        buyer_phone = request.form.get("buyer_phone", "").strip()
+        if not buyer_name or not buyer_phone:
+            flash("Buyer name and phone are required.", "error")
+            return redirect(request.referrer or url_for("seller_dashboard"))
+
+        # Read the range inside the write transaction: it is rewritten from
+        # these bounds, and another worker may have split it meanwhile.
+        db = get_db()
+        begin_write(db)
+        sale = find_sale(db, number)
         if not sale:
+            db.rollback()
             flash("Sale not found.", "error")
             return redirect(request.referrer or url_for("seller_dashboard"))
 
         if g.user["role"] != "superuser" and sale["seller_id"] != g.user["id"]:
+            db.rollback()
             flash("You do not have permission to edit this sale.", "error")
             return redirect(url_for("seller_dashboard"))
 
-        buyer_name = request.form.get("buyer_name", "").strip()
-        buyer_phone = request.form.get("buyer_phone", "").strip()
-        if not buyer_name or not buyer_phone:
-            flash("Buyer name and phone are required.", "error")
-            return redirect(request.referrer or url_for("seller_dashboard"))
-
-        db = get_db()
-        db.execute(
-            "UPDATE sales SET buyer_name = ?, buyer_phone = ? WHERE number = ?",
-            (buyer_name, buyer_phone, number),
-        )
+        if sale["quantity"] == 1:
+            db.execute(
+                "UPDATE orders SET buyer_name = ?, buyer_phone = ? WHERE id = ?",
+                (buyer_name, buyer_phone, sale["order_id"]),
+            )
+        else:
+            # Editing one number of a larger order moves it into its own order.
+            remove_sold_number(db, sale, number)
+            create_order(
+                db, sale["seller_id"], buyer_name, buyer_phone, sale["sold_at"], [[number, number]]
+            )
         log_audit(
             "sale_edit",
             g.user["id"],
@@ -378,21 +525,23 @@ def create_app() -> Flask:
 
     @app.route("/sale/<int:number>/void", methods=["POST"])
     @login_required
+    @write_admission
     def void_sale(number: int):
-        sale = query_one(
-            "SELECT number, seller_id, buyer_name, buyer_phone, sold_at FROM sales WHERE number = ?",
-            (number,),
-        )
+        db = get_db()
+        begin_write(db)
+        sale = find_sale(db, number)
         if not sale:
+            db.rollback()
             flash("Sale not found.", "error")
             return redirect(request.referrer or url_for("seller_dashboard"))
 
         if g.user["role"] != "superuser" and sale["seller_id"] != g.user["id"]:
+            db.rollback()
             flash("You do not have permission to void this sale.", "error")
             return redirect(url_for("seller_dashboard"))
 
-        db = get_db()
-        db.execute("DELETE FROM sales WHERE number = ?", (number,))
+        remove_sold_number(db, sale, number)
+        record_activity(db, sale["seller_id"], now_ts(), voids=1)
         log_audit(
             "sale_void",
             g.user["id"],
@@ -411,20 +560,26 @@ def create_app() -> Flask:
 
     @app.route("/reservation/<int:number>/release", methods=["POST"])
     @login_required
+    @write_admission
     def release_reservation(number: int):
+        # Check inside the transaction: another worker may expire or release
+        # the reservation in the meantime.
+        db = get_db()
+        begin_write(db)
         reservation = query_one(
             "SELECT number, seller_id, reserved_until FROM reservations WHERE number = ?",
             (number,),
         )
         if not reservation:
+            db.rollback()
             flash("Reservation not found.", "error")
             return redirect(request.referrer or url_for("seller_dashboard"))
 
         if g.user["role"] != "superuser" and reservation["seller_id"] != g.user["id"]:
+            db.rollback()
             flash("You do not have permission to release this reservation.", "error")
             return redirect(url_for("seller_dashboard"))
 
-        db = get_db()
         db.execute("DELETE FROM reservations WHERE number = ?", (number,))
         log_audit(
             "reservation_release",
@@ -443,46 +598,17 @@ def create_app() -> Flask:
     def admin_dashboard():
         cleanup_expired_reservations()
 
-        total_sold = query_value("SELECT COUNT(*) FROM sales")
-        total_reserved = query_value("SELECT COUNT(*) FROM reservations")
-        total_remaining = MAX_NUMBER - total_sold - total_reserved
-
-        seller_stats = query_all(
-            "SELECT u.id, u.username, COUNT(s.id) AS sold_count "
-            "FROM users u "
-            "LEFT JOIN sales s ON s.seller_id = u.id "
-            "WHERE u.role = 'seller' "
-            "GROUP BY u.id "
-            "ORDER BY sold_count DESC, u.username ASC"
-        )
-
-        recent_sales = query_all(
-            "SELECT s.number, s.buyer_name, s.buyer_phone, s.sold_at, u.username AS seller_username "
-            "FROM sales s "
-            "JOIN users u ON u.id = s.seller_id "
-            "ORDER BY s.sold_at DESC "
-            "LIMIT 20"
-        )
-
-        recent_audit = query_all(
-            "SELECT a.action, a.number, a.created_at, u.username AS actor_username "
-            "FROM audit_log a "
-            "LEFT JOIN users u ON u.id = a.actor_id "
-            "ORDER BY a.created_at DESC "
-            "LIMIT 20"
+        aggregates = current_app.extensions["aggregate_cache"].get(
+            "admin_dashboard", admin_aggregates
         )
 
         number_query = parse_int(request.args.get("number"), None)
         search_sale = None
         if number_query is not None:
             if 1 <= number_query <= MAX_NUMBER:
-                sale = query_one(
-                    "SELECT s.number, s.buyer_name, s.buyer_phone, s.sold_at, u.username AS seller_username, s.seller_id "
-                    "FROM sales s JOIN users u ON u.id = s.seller_id WHERE s.number = ?",
-                    (number_query,),
-                )
+                sale = find_sale(get_db(), number_query)
                 if sale:
-                    search_sale = dict(sale)
+                    search_sale = sale
                     search_sale["status"] = "sold"
                 else:
                     reservation = query_one(
@@ -500,33 +626,256 @@ def create_app() -> Flask:
 
         return render_template(
             "admin_dashboard.html",
-            total_sold=total_sold,
-            total_reserved=total_reserved,
-            total_remaining=total_remaining,
-            seller_stats=seller_stats,
-            recent_sales=recent_sales,
-            recent_audit=recent_audit,
+            total_sold=aggregates["total_sold"],
+            total_reserved=aggregates["total_reserved"],
+            total_remaining=aggregates["total_remaining"],
+            seller_stats=aggregates["seller_stats"],
+            recent_sales=aggregates["recent_sales"],
+            recent_audit=aggregates["recent_audit"],
             search_sale=search_sale,
             max_number=MAX_NUMBER,
         )
 
+    @app.route("/admin/stats/hourly")
+    @superuser_required
+    def hourly_stats():
+        hours = parse_int(request.args.get("hours"), ROLLUP_DEFAULT_HOURS)
+        hours = max(1, min(hours, ROLLUP_MAX_HOURS))
+        seller_id = parse_int(request.args.get("seller_id"), None)
+
+        current = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        buckets = [
+            hour_bucket((current - timedelta(hours=offset)).isoformat())
+            for offset in range(hours - 1, -1, -1)
+        ]
+
+        clauses = ["hour >= ?"]
+        params: list = [buckets[0]]
+        if seller_id is not None:
+            clauses.append("seller_id = ?")
+            params.append(seller_id)
+        rows = query_all(
+            "SELECT hour, SUM(sales) AS sales, SUM(voids) AS voids, "
+            "SUM(reservations) AS reservations "
+            f"FROM sales_hourly WHERE {' AND '.join(clauses)} "
+            "GROUP BY hour",
+            tuple(params),
+        )
+        by_hour = {row["hour"]: row for row in rows}
+        series = []
+        for bucket in buckets:
+            row = by_hour.get(bucket)
+            series.append(
+                {
+                    "hour": bucket,
+                    "sales": row["sales"] if row else 0,
+                    "voids": row["voids"] if row else 0,
+                    "reservations": row["reservations"] if row else 0,
+                }
+            )
+        return jsonify({"hours": hours, "seller_id": seller_id, "series": series})
+
+    @app.route("/admin/metrics/writes")
+    @superuser_required
+    def write_metrics():
+        return jsonify(current_app.extensions["write_scheduler"].metrics())
+
+    @app.route("/admin/metrics/cache")
+    @superuser_required
+    def cache_metrics():
+        return jsonify(current_app.extensions["aggregate_cache"].metrics())
+
+    @app.route("/admin/backups")
+    @superuser_required
+    def backup_status():
+        backup_dir = current_app.config["BACKUP_DIR"]
+        status = read_backup_status(backup_dir)
+        lag_seconds = None
+        if status:
+            finished = datetime.fromisoformat(status["finished_at"])
+            lag_seconds = int((datetime.utcnow() - finished).total_seconds())
+        return jsonify(
+            {
+                "last_backup": status,
+                "lag_seconds": lag_seconds,
+                "backups": list_backups(backup_dir),
+            }
+        )
+
     @app.route("/admin/sales/export")
     @superuser_required
     def export_sales():
-        rows = query_all("SELECT number, buyer_name FROM sales ORDER BY number ASC")
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["number", "buyer_name"])
-        for row in rows:
-            writer.writerow([row["number"], row["buyer_name"]])
+        # One row per stored range by default, so the export scales with orders.
+        # `?expand=1` streams the legacy one-row-per-number layout.
+        expand = request.args.get("expand") == "1"
+
+        def rows(db: sqlite3.Connection) -> Iterator[list]:
+            cursor = db.execute(
+                "SELECT r.start_number, r.end_number, o.buyer_name "
+                "FROM order_ranges r JOIN orders o ON o.id = r.order_id "
+                "ORDER BY r.start_number"
+            )
+            for start, end, buyer_name in cursor:
+                if expand:
+                    for number in range(start, end + 1):
+                        yield [number, buyer_name]
+                else:
+                    yield [start, end, end - start + 1, buyer_name]
 
-        response = make_response(output.getvalue())
+        if expand:
+            header = ["number", "buyer_name"]
+        else:
+            header = ["number_start", "number_end", "quantity", "buyer_name"]
+        return csv_stream_response("sales_export.csv", header, rows)
+
+    @app.route("/orders/<int:order_id>/receipt")
+    @login_required
+    def order_receipt_view(order_id: int):
+        # Sellers only get receipts for their own orders.
+        seller_id = None if g.user["role"] == "superuser" else g.user["id"]
+        receipt = order_receipt(get_db(), order_id, seller_id)
+        if receipt is None:
+            flash("Receipt not found.", "error")
+            return redirect(url_for("index"))
+        fmt = request.args.get("format", "html")
+        if fmt not in RECEIPT_FORMATS:
+            fmt = "html"
+        return receipt_response(receipt, fmt, f"recibo-pedido-{order_id}")
+
+    @app.route("/receipts")
+    @login_required
+    def buyer_receipt_view():
+        phone = request.args.get("phone", "").strip()
+        receipt = None
+        if phone:
+            seller_id = None if g.user["role"] == "superuser" else g.user["id"]
+            receipt = buyer_receipt(get_db(), phone, seller_id)
+            if receipt is None:
+                flash("No sales found for this phone.", "error")
+            else:
+                fmt = request.args.get("format", "html")
+                if fmt in ("text", "csv"):
+                    return receipt_response(receipt, fmt, receipt_filename(phone))
+        return render_template("receipt.html", receipt=receipt, phone=phone)
+
+    @app.route("/admin/receipts/export")
+    @superuser_required
+    def export_receipts():
+        # `?format=csv` streams one row per buyer; `?format=zip` streams one
+        # text receipt per buyer. Either way only one buyer is held in memory.
+        if request.args.get("format") == "zip":
+            body = stream_with_db(current_app.config["DATABASE"], receipts_zip_stream)
+            response = current_app.response_class(body, mimetype="application/zip")
+            response.headers["Content-Disposition"] = "attachment; filename=recibos.zip"
+            return response
+        return csv_stream_response("recibos.csv", RECEIPT_SUMMARY_HEADER, receipt_summary_rows)
+
+    @app.route("/admin/sales/import", methods=["POST"])
+    @superuser_required
+    def import_sales_csv():
+        result, error_response = import_upload(import_sales, "admin_dashboard")
+        if error_response is not None:
+            return error_response
+        imported, conflicts = result
+
+        if not conflicts:
+            flash(f"Imported {imported} sale(s).", "success")
+            return redirect(url_for("admin_dashboard"))
+
+        flash(
+            f"Imported {imported} sale(s); {len(conflicts)} row(s) were rejected. "
+            "See the downloaded conflict report.",
+            "error",
+        )
+        response = make_response(sales_conflicts_csv(conflicts))
         response.headers["Content-Type"] = "text/csv; charset=utf-8"
-        response.headers["Content-Disposition"] = "attachment; filename=sales_export.csv"
+        response.headers["Content-Disposition"] = "attachment; filename=sales_import_conflicts.csv"
         return response
 
+    @app.cli.command("import-sales")
+    @click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+    @click.option(
+        "--report",
+        "-r",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the conflict report to this file instead of stdout.",
+    )
+    def import_sales_command(csv_path: str, report: str | None) -> None:
+        """Import offline sales from a CSV of number, buyer name, buyer phone and seller."""
+        imported, conflicts = import_csv_file(import_sales, csv_path, cli_actor_id("import"))
+
+        if conflicts:
+            sheet = sales_conflicts_csv(conflicts)
+            if report:
+                with open(report, "w", encoding="utf-8", newline="") as handle:
+                    handle.write(sheet)
+            else:
+                click.echo(sheet, nl=False)
+        click.echo(f"Imported {imported} sale(s), {len(conflicts)} conflict(s).", err=True)
+
+    @app.route("/admin/draws", methods=["GET", "POST"])
+    @superuser_required
+    @write_admission
+    def admin_draws():
+        if request.method == "POST":
+            prizes = parse_int(request.form.get("prizes"), 0)
+            seed = request.form.get("seed", "").strip() or None
+            try:
+                draw_id = run_draw(g.user["id"], prizes, seed)
+                flash(f"Draw #{draw_id} completed.", "success")
+            except ValueError as exc:
+                flash(str(exc), "error")
+            except sqlite3.Error:
+                flash("Database error. Please try again.", "error")
+            return redirect(url_for("admin_draws"))
+
+        draws = query_all(
+            "SELECT d.id, d.seed, d.total_sold, d.prizes, d.drawn_at, u.username AS drawn_by "
+            "FROM draws d LEFT JOIN users u ON u.id = d.drawn_by "
+            "ORDER BY d.id DESC LIMIT 20"
+        )
+        winners: dict[int, list] = {draw["id"]: [] for draw in draws}
+        if winners:
+            placeholders = ",".join("?" * len(winners))
+            for row in query_all(
+                "SELECT w.draw_id, w.position, w.rank, w.number, w.buyer_name, w.buyer_phone, "
+                "u.username AS seller_username "
+                "FROM draw_winners w LEFT JOIN users u ON u.id = w.seller_id "
+                f"WHERE w.draw_id IN ({placeholders}) ORDER BY w.draw_id, w.position",
+                tuple(winners),
+            ):
+                winners[row["draw_id"]].append(row)
+
+        return render_template(
+            "admin_draws.html",
+            draws=draws,
+            winners=winners,
+            total_sold=query_value("SELECT COALESCE(SUM(quantity), 0) FROM orders"),
+            max_prizes=MAX_PRIZES,
+        )
+
+    @app.cli.command("draw")
+    @click.option("--prizes", type=int, default=1, show_default=True)
+    @click.option("--seed", default=None, help="Seed to use; a random one is recorded if omitted.")
+    def draw_command(prizes: int, seed: str | None) -> None:
+        """Draw winners uniformly from the sold numbers."""
+        actor_id = cli_actor_id("draw")
+        try:
+            draw_id = run_draw(actor_id, prizes, seed)
+        except ValueError as exc:
+            raise click.ClickException(str(exc)) from exc
+
+        draw = query_one("SELECT seed, total_sold FROM draws WHERE id = ?", (draw_id,))
+        click.echo(f"Draw #{draw_id} seed={draw['seed']} sold={draw['total_sold']}")
+        for row in query_all(
+            "SELECT position, number, buyer_name FROM draw_winners WHERE draw_id = ? ORDER BY position",
+            (draw_id,),
+        ):
+            click.echo(f"{row['position']}. {row['number']} {row['buyer_name']}")
+
     @app.route("/admin/users", methods=["GET", "POST"])
     @superuser_required
+    @write_admission
     def admin_users():
         if request.method == "POST":
             username = request.form.get("username", "").strip()
@@ -534,13 +883,13 @@ def create_app() -> Flask:
             error = None
             if not username or not password:
                 error = "Username and password are required."
-            elif len(password) < 6:
-                error = "Password should be at least 6 characters."
+            elif len(password) < MIN_PASSWORD_LENGTH:
+                error = f"Password should be at least {MIN_PASSWORD_LENGTH} characters."
 
             if error is None:
                 db = get_db()
                 try:
-                    db.execute("BEGIN")
+                    begin_write(db)
                     cursor = db.execute(
                         "INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)",
                         (
@@ -573,34 +922,147 @@ def create_app() -> Flask:
 
         sellers = query_all(
             "SELECT u.id, u.username, u.created_at, "
-            "(SELECT COUNT(*) FROM sales s WHERE s.seller_id = u.id) AS sold_count, "
+            "(SELECT COALESCE(SUM(o.quantity), 0) FROM orders o WHERE o.seller_id = u.id) AS sold_count, "
             "(SELECT COUNT(*) FROM reservations r WHERE r.seller_id = u.id) AS reserved_count "
             "FROM users u WHERE u.role = 'seller' ORDER BY u.username"
         )
         return render_template("admin_users.html", sellers=sellers)
 
-    @app.route("/admin/users/<int:user_id>/delete", methods=["POST"])
-    @superuser_required
-    def delete_seller(user_id: int):
-        seller = query_one(
-            "SELECT id, username FROM users WHERE id = ? AND role = 'seller'",
-            (user_id,),
+    @app.cli.command("migrate")
+    def migrate_command() -> None:
+        """Apply pending schema migrations."""
+        applied = init_db()
+        click.echo(f"Applied {applied} migration(s); schema version {len(MIGRATIONS)}.")
+
+    @app.cli.command("backup")
+    @click.option(
+        "--interval",
+        type=float,
+        default=None,
+        help="Keep running and take a backup every INTERVAL minutes.",
+    )
+    def backup_command(interval: float | None) -> None:
+        """Take an online backup of the database while the app keeps serving."""
+        while True:
+            try:
+                status = backup_database(
+                    current_app.config["DATABASE"],
+                    current_app.config["BACKUP_DIR"],
+                    current_app.config["BACKUP_KEEP"],
+                )
+            except (OSError, sqlite3.Error) as exc:
+                error = f"Backup failed: {exc}"
+            else:
+                click.echo(
+                    f"{status['finished_at']} {status['name']}: {status['integrity']}, "
+                    f"{status['pages']} pages in {status['duration_seconds']}s"
+                )
+                error = None
+                if status["integrity"] != "ok":
+                    error = "Backup failed the integrity check."
+            if interval is None:
+                if error:
+                    raise click.ClickException(error)
+                return
+            # A scheduled run must outlive a bad snapshot, so report the
+            # failure and try again at the next interval.
+            if error:
+                click.echo(f"{now_ts()} {error}", err=True)
+            time.sleep(interval * 60)
+
+    @app.cli.command("restore")
+    @click.argument("backup_path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--yes", is_flag=True, help="Do not ask for confirmation.")
+    def restore_command(backup_path: str, yes: bool) -> None:
+        """Replace the live database with BACKUP_PATH."""
+        integrity = check_integrity(backup_path)
+        if integrity != "ok":
+            raise click.ClickException(f"Backup failed the integrity check: {integrity}")
+        if not yes:
+            click.confirm("Replace the live database with this backup?", abort=True)
+
+        # Snapshot the current state first so a wrong restore can be undone.
+        # Rotation is skipped here: it could delete the backup being restored.
+        safety = backup_database(
+            current_app.config["DATABASE"], current_app.config["BACKUP_DIR"], keep=None
         )
-        if not seller:
-            flash("Seller not found.", "error")
-            return redirect(url_for("admin_users"))
+        if safety["integrity"] != "ok":
+            raise click.ClickException("Could not save the current database; nothing was restored.")
+        click.echo(f"Saved current database as {safety['name']}.")
+        restore_database(backup_path, current_app.config["DATABASE"])
+        click.echo(f"Restored {backup_path}.")
+
+    @app.cli.command("bootstrap-superuser")
+    def bootstrap_superuser_command() -> None:
+        """Create the superuser from the environment if none exists."""
+        if bootstrap_superuser():
+            click.echo("Superuser created.")
+        else:
+            click.echo("Superuser already exists or credentials are missing.")
+
+    @app.route("/admin/users/import", methods=["POST"])
+    @superuser_required
+    def import_sellers_csv():
+        results, error_response = import_upload(import_sellers, "admin_users")
+        if error_response is not None:
+            return error_response
 
-        sold_count = query_value("SELECT COUNT(*) FROM sales WHERE seller_id = ?", (user_id,))
-        reserved_count = query_value(
-            "SELECT COUNT(*) FROM reservations WHERE seller_id = ?", (user_id,)
-        )
-        if sold_count or reserved_count:
-            flash("Seller has sales or reservations and cannot be deleted.", "error")
-            return redirect(url_for("admin_users"))
+        response = make_response(seller_credentials_csv(results))
+        response.headers["Content-Type"] = "text/csv; charset=utf-8"
+        response.headers["Content-Disposition"] = "attachment; filename=seller_credentials.csv"
+        return response
+
+    @app.cli.command("import-sellers")
+    @click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+    @click.option(
+        "--output",
+        "-o",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the credentials sheet to this file instead of stdout.",
+    )
+    def import_sellers_command(csv_path: str, output: str | None) -> None:
+        """Create seller accounts from a CSV of usernames and optional passwords."""
+        results = import_csv_file(import_sellers, csv_path, cli_actor_id("import"))
+
+        sheet = seller_credentials_csv(results)
+        if output:
+            with open(output, "w", encoding="utf-8", newline="") as handle:
+                handle.write(sheet)
+        else:
+            click.echo(sheet, nl=False)
 
+        created = sum(1 for item in results if item["status"] == "created")
+        click.echo(f"Created {created} of {len(results)} seller(s).", err=True)
+
+    @app.route("/admin/users/<int:user_id>/delete", methods=["POST"])
+    @superuser_required
+    @write_admission
+    def delete_seller(user_id: int):
+        # Count sales inside the transaction so a sale committed by another
+        # worker cannot slip in between the check and the delete.
         db = get_db()
         try:
-            db.execute("BEGIN")
+            begin_write(db)
+            seller = query_one(
+                "SELECT id, username FROM users WHERE id = ? AND role = 'seller'",
+                (user_id,),
+            )
+            if not seller:
+                db.rollback()
+                flash("Seller not found.", "error")
+                return redirect(url_for("admin_users"))
+
+            sold_count = query_value(
+                "SELECT COALESCE(SUM(quantity), 0) FROM orders WHERE seller_id = ?", (user_id,)
+            )
+            reserved_count = query_value(
+                "SELECT COUNT(*) FROM reservations WHERE seller_id = ?", (user_id,)
+            )
+            if sold_count or reserved_count:
+                db.rollback()
+                flash("Seller has sales or reservations and cannot be deleted.", "error")
+                return redirect(url_for("admin_users"))
+
             db.execute("DELETE FROM users WHERE id = ?", (user_id,))
             log_audit(
                 "seller_delete",
@@ -640,8 +1102,8 @@ def create_app() -> Flask:
             clauses.append("a.action = ?")
             params.append(action)
         if number is not None:
-            clauses.append("a.number = ?")
-            params.append(number)
+            clauses.append("a.number <= ? AND COALESCE(a.number_end, a.number) >= ?")
+            params.extend([number, number])
         if actor:
             clauses.append("actor.username = ?")
             params.append(actor)
@@ -672,7 +1134,7 @@ def create_app() -> Flask:
         offset = (page - 1) * page_size
 
         rows = query_all(
-            "SELECT a.action, a.number, a.created_at, a.details, "
+            "SELECT a.action, a.number, a.number_end, a.created_at, a.details, "
             "actor.username AS actor_username, seller.username AS seller_username "
             "FROM audit_log a "
             "LEFT JOIN users actor ON actor.id = a.actor_id "
@@ -722,7 +1184,7 @@ def create_app() -> Flask:
 
 def get_db() -> sqlite3.Connection:
     if "db" not in g:
-        g.db = sqlite3.connect(current_app.config["DATABASE"])
+        g.db = sqlite3.connect(current_app.config["DATABASE"], timeout=DB_BUSY_TIMEOUT)
         g.db.row_factory = sqlite3.Row
     return g.db
 
@@ -733,8 +1195,43 @@ def close_db(exception) -> None:
         db.close()
 
 
-def init_db() -> None:
-    db = sqlite3.connect(current_app.config["DATABASE"])
+def init_db() -> int:
+    # Apply pending migrations and return how many ran. A current schema costs a
+    # couple of PRAGMA reads; otherwise BEGIN IMMEDIATE makes concurrently booting
+    # workers queue up and re-check the version, so each migration runs once.
+    db = sqlite3.connect(
+        current_app.config["DATABASE"], timeout=MIGRATION_LOCK_TIMEOUT, isolation_level=None
+    )
+    try:
+        # WAL is persistent and lets readers, including backups, hold a
+        # snapshot while sellers keep committing.
+        db.execute("PRAGMA journal_mode = WAL")
+        if schema_version(db) >= len(MIGRATIONS):
+            return 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(db)
+            for index in range(version, len(MIGRATIONS)):
+                MIGRATIONS[index](db)
+                db.execute(f"PRAGMA user_version = {index + 1}")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return max(0, len(MIGRATIONS) - version)
+    finally:
+        db.close()
+
+
+def schema_version(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Migrations run in order; index + 1 is the schema version each one produces.
+# Never edit a released migration, append a new one instead.
+
+def migrate_base_schema(db: sqlite3.Connection) -> None:
+    # IF NOT EXISTS keeps this safe for databases created before versioning.
     db.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -789,11 +1286,216 @@ def init_db() -> None:
     db.execute("CREATE INDEX IF NOT EXISTS idx_sales_sold_at ON sales(sold_at)")
     db.execute("CREATE INDEX IF NOT EXISTS idx_reservations_until ON reservations(reserved_until)")
     db.execute("CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log(created_at)")
-    db.commit()
-    db.close()
 
 
-def bootstrap_superuser() -> None:
+def migrate_sales_hourly(db: sqlite3.Connection) -> None:
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sales_hourly (
+            hour TEXT NOT NULL,
+            seller_id INTEGER NOT NULL,
+            sales INTEGER NOT NULL DEFAULT 0,
+            voids INTEGER NOT NULL DEFAULT 0,
+            reservations INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, seller_id)
+        ) WITHOUT ROWID
+        """
+    )
+    if db.execute("SELECT 1 FROM sales_hourly LIMIT 1").fetchone() is None:
+        backfill_rollups(db)
+
+
+def backfill_rollups(db: sqlite3.Connection) -> None:
+    # Rebuild the hourly rollups from existing rows. Voided sales no longer
+    # exist in `sales`, so their original sale hour comes from the void audit.
+    upsert = (
+        "ON CONFLICT(hour, seller_id) DO UPDATE SET "
+        "sales = sales + excluded.sales, "
+        "voids = voids + excluded.voids, "
+        "reservations = reservations + excluded.reservations"
+    )
+    db.execute(
+        "INSERT INTO sales_hourly (hour, seller_id, sales, voids, reservations) "
+        "SELECT hour, seller_id, COUNT(*), 0, 0 FROM ("
+        "  SELECT substr(sold_at, 1, 13) || ':00' AS hour, seller_id FROM sales "
+        "  UNION ALL "
+        "  SELECT substr(json_extract(details, '$.sold_at'), 1, 13) || ':00', seller_id "
+        "  FROM audit_log WHERE action = 'sale_void' AND seller_id IS NOT NULL"
+        ") WHERE hour IS NOT NULL GROUP BY hour, seller_id "
+        f"{upsert}"
+    )
+    db.execute(
+        "INSERT INTO sales_hourly (hour, seller_id, sales, voids, reservations) "
+        "SELECT substr(created_at, 1, 13) || ':00', seller_id, 0, "
+        "SUM(action = 'sale_void'), SUM(action = 'reservation_create') "
+        "FROM audit_log "
+        "WHERE action IN ('sale_void', 'reservation_create') AND seller_id IS NOT NULL "
+        "GROUP BY 1, 2 "
+        f"{upsert}"
+    )
+
+
+def migrate_draws(db: sqlite3.Connection) -> None:
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS draws (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seed TEXT NOT NULL,
+            total_sold INTEGER NOT NULL,
+            prizes INTEGER NOT NULL,
+            drawn_by INTEGER NOT NULL,
+            drawn_at TEXT NOT NULL,
+            FOREIGN KEY (drawn_by) REFERENCES users(id)
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS draw_winners (
+            draw_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            number INTEGER NOT NULL,
+            seller_id INTEGER NOT NULL,
+            buyer_name TEXT NOT NULL,
+            buyer_phone TEXT NOT NULL,
+            PRIMARY KEY (draw_id, position),
+            FOREIGN KEY (draw_id) REFERENCES draws(id)
+        )
+        """
+    )
+
+
+def migrate_orders(db: sqlite3.Connection) -> None:
+    # Replaces one `sales` row per number with one order per buyer purchase
+    # and its consecutive number ranges.
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER NOT NULL,
+            buyer_name TEXT NOT NULL,
+            buyer_phone TEXT NOT NULL,
+            sold_at TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            FOREIGN KEY (seller_id) REFERENCES users(id)
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_ranges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            start_number INTEGER NOT NULL,
+            end_number INTEGER NOT NULL,
+            CHECK (start_number <= end_number),
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_seller ON orders(seller_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_sold_at ON orders(sold_at)")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_ranges_interval "
+        "ON order_ranges(start_number, end_number)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_order_ranges_order ON order_ranges(order_id)")
+    # Ranges must never overlap; this replaces the old UNIQUE(number) and
+    # surfaces as sqlite3.IntegrityError like it did.
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS order_ranges_no_overlap
+        BEFORE INSERT ON order_ranges
+        WHEN (
+            SELECT end_number FROM order_ranges
+            WHERE start_number <= NEW.end_number
+            ORDER BY start_number DESC LIMIT 1
+        ) >= NEW.start_number
+        BEGIN
+            SELECT RAISE(ABORT, 'number range overlaps an existing order');
+        END
+        """
+    )
+    columns = {row[1] for row in db.execute("PRAGMA table_info(audit_log)")}
+    if "number_end" not in columns:
+        db.execute("ALTER TABLE audit_log ADD COLUMN number_end INTEGER")
+
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales'").fetchone():
+        db.row_factory = sqlite3.Row
+        cursor = db.execute(
+            "SELECT number, seller_id, buyer_name, buyer_phone, sold_at FROM sales "
+            "ORDER BY seller_id, buyer_name, buyer_phone, sold_at, number"
+        )
+        for key, rows in groupby(
+            cursor,
+            key=lambda row: (row["seller_id"], row["buyer_name"], row["buyer_phone"], row["sold_at"]),
+        ):
+            create_order(db, *key, number_ranges(row["number"] for row in rows))
+        db.row_factory = None
+        db.execute("DROP TABLE sales")
+
+
+def migrate_buyer_phone_index(db: sqlite3.Connection) -> None:
+    # Buyer receipts look orders up by phone.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_buyer_phone ON orders(buyer_phone)")
+
+
+def migrate_range_update_guard(db: sqlite3.Connection) -> None:
+    # Edits and voids shrink or split ranges with UPDATE, which the insert
+    # trigger does not see.
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS order_ranges_no_overlap_update
+        BEFORE UPDATE OF start_number, end_number ON order_ranges
+        WHEN (
+            SELECT end_number FROM order_ranges
+            WHERE start_number <= NEW.end_number AND id != NEW.id
+            ORDER BY start_number DESC LIMIT 1
+        ) >= NEW.start_number
+        BEGIN
+            SELECT RAISE(ABORT, 'number range overlaps an existing order');
+        END
+        """
+    )
+
+
+MIGRATIONS = [
+    migrate_base_schema,
+    migrate_sales_hourly,
+    migrate_draws,
+    migrate_orders,
+    migrate_buyer_phone_index,
+    migrate_range_update_guard,
+]
+
+
+def hour_bucket(timestamp: str) -> str:
+    return f"{timestamp[:13]}:00"
+
+
+def record_activity(
+    db: sqlite3.Connection,
+    seller_id: int,
+    timestamp: str,
+    sales: int = 0,
+    voids: int = 0,
+    reservations: int = 0,
+) -> None:
+    # Called inside the caller's write transaction so the rollup never drifts
+    # from the rows it summarizes.
+    db.execute(
+        "INSERT INTO sales_hourly (hour, seller_id, sales, voids, reservations) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(hour, seller_id) DO UPDATE SET "
+        "sales = sales + excluded.sales, "
+        "voids = voids + excluded.voids, "
+        "reservations = reservations + excluded.reservations",
+        (hour_bucket(timestamp), seller_id, sales, voids, reservations),
+    )
+
+
+def bootstrap_superuser() -> bool:
     username = (
         os.environ.get("SUPERUSER_USERNAME")
         or os.environ.get("SUPERUSER_USENAME")
@@ -801,11 +1503,11 @@ def bootstrap_superuser() -> None:
     )
     password = os.environ.get("SUPERUSER_PASSWORD") or DEFAULT_SUPERUSER_PASSWORD
     if not username or not password:
-        return
+        return False
 
     existing = query_value("SELECT COUNT(*) FROM users WHERE role = 'superuser'")
     if existing:
-        return
+        return False
 
     execute(
         "INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)",
@@ -816,32 +1518,332 @@ def bootstrap_superuser() -> None:
             now_ts(),
         ),
     )
+    return True
+
+
+def cli_actor_id(purpose: str) -> int:
+    # CLI commands record their changes as the first superuser.
+    actor_id = query_value("SELECT MIN(id) FROM users WHERE role = 'superuser'")
+    if not actor_id:
+        raise click.ClickException(f"No superuser exists to record the {purpose}.")
+    return actor_id
 
 
 def cleanup_expired_reservations() -> None:
     now = now_ts()
     db = get_db()
-    expired = db.execute(
-        "SELECT id, number, seller_id, reserved_until FROM reservations WHERE reserved_until < ?",
-        (now,),
-    ).fetchall()
-    if not expired:
+    expired_query = (
+        "SELECT id, number, seller_id, reserved_until FROM reservations WHERE reserved_until < ?"
+    )
+    if db.execute(f"{expired_query} LIMIT 1", (now,)).fetchone() is None:
         return
 
-    db.execute("BEGIN")
+    if g.get("write_slot"):
+        begin_write(db)
+        purge_expired_reservations(db, expired_query, now)
+        return
+    # Page views only clean up when no write is queued here and no other
+    # process holds the database lock. They make a single non-waiting attempt
+    # and the next request retries, so a rush of readers never competes with
+    # sellers for the lock.
+    try:
+        with current_app.extensions["write_scheduler"].slot(blocking=False):
+            if not try_begin_write(db):
+                return
+            purge_expired_reservations(db, expired_query, now)
+        current_app.extensions["aggregate_cache"].invalidate()
+    except WriteBusy:
+        pass
+
+
+def purge_expired_reservations(db: sqlite3.Connection, expired_query: str, now: str) -> None:
+    # Runs inside a write transaction the caller has begun.
+    expired = db.execute(expired_query, (now,)).fetchall()
+    by_seller: dict[tuple[int, str], list[int]] = {}
     for row in expired:
-        log_audit(
-            "reservation_expired",
-            row["seller_id"],
-            number=row["number"],
-            seller_id=row["seller_id"],
-            details={"reserved_until": row["reserved_until"]},
-            db=db,
-        )
+        by_seller.setdefault((row["seller_id"], row["reserved_until"]), []).append(row["number"])
+    for (seller_id, reserved_until), numbers in by_seller.items():
+        for start, end in number_ranges(numbers):
+            log_audit(
+                "reservation_expired",
+                seller_id,
+                number=start,
+                number_end=end,
+                seller_id=seller_id,
+                details={"reserved_until": reserved_until},
+                db=db,
+            )
     db.executemany("DELETE FROM reservations WHERE id = ?", [(row["id"],) for row in expired])
     db.commit()
 
 
+# Admin aggregates
+
+def admin_aggregates() -> dict:
+    total_sold = query_value("SELECT COALESCE(SUM(quantity), 0) FROM orders")
+    total_reserved = query_value("SELECT COUNT(*) FROM reservations")
+
+    seller_stats = [
+        dict(row)
+        for row in query_all(
+            "SELECT u.id, u.username, COALESCE(SUM(o.quantity), 0) AS sold_count "
+            "FROM users u "
+            "LEFT JOIN orders o ON o.seller_id = u.id "
+            "WHERE u.role = 'seller' "
+            "GROUP BY u.id "
+            "ORDER BY sold_count DESC, u.username ASC"
+        )
+    ]
+
+    recent_sales = [
+        dict(row)
+        for row in query_all(
+            "SELECT o.id, o.buyer_name, o.buyer_phone, o.sold_at, o.quantity, "
+            "u.username AS seller_username "
+            "FROM orders o "
+            "JOIN users u ON u.id = o.seller_id "
+            "ORDER BY o.sold_at DESC "
+            "LIMIT 20"
+        )
+    ]
+    order_ranges = ranges_for_orders(get_db(), [sale["id"] for sale in recent_sales])
+    for sale in recent_sales:
+        sale["ranges"] = order_ranges.get(sale["id"], [])
+        sale["numbers"] = format_range_list(sale["ranges"])
+
+    recent_audit = [
+        dict(row)
+        for row in query_all(
+            "SELECT a.action, a.number, a.number_end, a.created_at, u.username AS actor_username "
+            "FROM audit_log a "
+            "LEFT JOIN users u ON u.id = a.actor_id "
+            "ORDER BY a.created_at DESC "
+            "LIMIT 20"
+        )
+    ]
+
+    return {
+        "total_sold": total_sold,
+        "total_reserved": total_reserved,
+        "total_remaining": MAX_NUMBER - total_sold - total_reserved,
+        "seller_stats": seller_stats,
+        "recent_sales": recent_sales,
+        "recent_audit": recent_audit,
+    }
+
+
+class AggregateCache:
+    # Short-TTL, per-process cache with request coalescing: while one request
+    # computes a key, concurrent requests for the same key wait for its result
+    # instead of running the same queries. Writes in this process invalidate
+    # immediately; the TTL bounds staleness from writes in other processes.
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[float, int, object]] = {}
+        self._inflight: dict[str, Future] = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] == self.generation and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[2]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[key] = Future()
+                leader_generation = self.generation
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            value = compute()
+        except BaseException as exc:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.set_exception(exc)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            # A write during the computation makes the result unsafe to keep,
+            # but the waiters that joined this flight still share it.
+            if leader_generation == self.generation and self.ttl > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, leader_generation, value)
+        flight.set_result(value)
+        return value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl,
+                "generation": self.generation,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+# Write admission
+
+class WriteBusy(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Write queue busy; retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+def write_busy_response(exc: WriteBusy):
+    response = make_response(
+        "The server is busy saving other changes. Please try again shortly.", 429
+    )
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response
+
+
+class WriteScheduler:
+    # One lock per process serializes write transactions so they queue here
+    # instead of piling up on SQLite's file lock. `depth` counts waiting and
+    # running writers and is capped at `limit`.
+
+    def __init__(self, limit: int, timeout: float) -> None:
+        self.limit = max(1, limit)
+        self.timeout = timeout
+        self._write_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self.depth = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.busy_retries = 0
+        self.waits: deque[float] = deque(maxlen=WRITE_METRICS_WINDOW)
+        self.holds: deque[float] = deque(maxlen=WRITE_METRICS_WINDOW)
+
+    def retry_after(self) -> int:
+        with self._state_lock:
+            average_hold = sum(self.holds) / len(self.holds) if self.holds else 0.0
+            return max(1, round(average_hold * self.depth))
+
+    @contextmanager
+    def slot(self, blocking: bool = True) -> Iterator[None]:
+        with self._state_lock:
+            if self.depth >= self.limit:
+                self.rejected += 1
+                full = True
+            else:
+                self.depth += 1
+                full = False
+        if full:
+            raise WriteBusy(self.retry_after())
+
+        started = time.monotonic()
+        acquired = self._write_lock.acquire(blocking, self.timeout if blocking else -1)
+        waited = time.monotonic() - started
+        if not acquired:
+            with self._state_lock:
+                self.depth -= 1
+                if blocking:
+                    self.timeouts += 1
+            raise WriteBusy(self.retry_after())
+
+        with self._state_lock:
+            self.admitted += 1
+            self.waits.append(waited)
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started - waited
+            self._write_lock.release()
+            with self._state_lock:
+                self.depth -= 1
+                self.holds.append(held)
+
+    def record_retry(self) -> None:
+        with self._state_lock:
+            self.busy_retries += 1
+
+    def metrics(self) -> dict:
+        with self._state_lock:
+            waits = sorted(self.waits)
+            holds = list(self.holds)
+            return {
+                "queue_depth": self.depth,
+                "queue_limit": self.limit,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "busy_retries": self.busy_retries,
+                "wait_ms_p50": percentile_ms(waits, 0.5),
+                "wait_ms_p95": percentile_ms(waits, 0.95),
+                "wait_ms_max": percentile_ms(waits, 1.0),
+                "hold_ms_avg": round(sum(holds) / len(holds) * 1000, 2) if holds else 0.0,
+            }
+
+
+def percentile_ms(ordered: list[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return round(ordered[index] * 1000, 2)
+
+
+def is_busy_error(exc: sqlite3.OperationalError) -> bool:
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(exc) or "busy" in str(exc)
+
+
+def begin_write(db: sqlite3.Connection) -> None:
+    # Other processes can still hold the file lock, so retry BEGIN IMMEDIATE
+    # with a short busy timeout and jittered exponential backoff, then give up
+    # with WriteBusy. This bounds the wait to roughly WRITE_RETRIES *
+    # WRITE_ATTEMPT_TIMEOUT instead of stacking full connection timeouts.
+    scheduler = current_app.extensions["write_scheduler"]
+    db.execute(f"PRAGMA busy_timeout = {int(WRITE_ATTEMPT_TIMEOUT * 1000)}")
+    try:
+        for attempt in range(WRITE_RETRIES):
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as exc:
+                if not is_busy_error(exc):
+                    raise
+                scheduler.record_retry()
+                if attempt < WRITE_RETRIES - 1:
+                    time.sleep(random.uniform(0, WRITE_RETRY_BASE * 2**attempt))
+        raise WriteBusy(scheduler.retry_after())
+    finally:
+        db.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+
+
+def try_begin_write(db: sqlite3.Connection) -> bool:
+    # One BEGIN IMMEDIATE without waiting, for optional background writes.
+    db.execute("PRAGMA busy_timeout = 0")
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        return True
+    except sqlite3.OperationalError as exc:
+        if not is_busy_error(exc):
+            raise
+        return False
+    finally:
+        db.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+
+
 # Query helpers
 
 def query_one(query: str, params: tuple | None = None):
@@ -880,14 +1882,1018 @@ def log_audit(
     seller_id: int | None = None,
     details: dict | None = None,
     db: sqlite3.Connection | None = None,
+    number_end: int | None = None,
 ) -> None:
     payload = json.dumps(details) if details is not None else None
+    if number_end == number:
+        number_end = None
     conn = db or get_db()
     conn.execute(
-        "INSERT INTO audit_log (action, actor_id, number, seller_id, details, created_at) "
-        "VALUES (?, ?, ?, ?, ?, ?)",
-        (action, actor_id, number, seller_id, payload, now_ts()),
+        "INSERT INTO audit_log (action, actor_id, number, number_end, seller_id, details, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (action, actor_id, number, number_end, seller_id, payload, now_ts()),
+    )
+
+
+# Order helpers
+#
+# Sales are stored as orders (buyer, seller, time) owning non-overlapping
+# number ranges. A number is sold when the range with the greatest start at
+# or below it also ends at or above it, which is one seek on
+# idx_order_ranges_interval.
+
+SALE_COLUMNS = (
+    "o.id AS order_id, o.seller_id, o.buyer_name, o.buyer_phone, o.sold_at, o.quantity, "
+    "r.id AS range_id, r.start_number, r.end_number"
+)
+
+
+def find_sale(db: sqlite3.Connection, number: int) -> dict | None:
+    row = db.execute(
+        f"SELECT {SALE_COLUMNS}, u.username AS seller_username "
+        "FROM order_ranges r "
+        "JOIN orders o ON o.id = r.order_id "
+        "JOIN users u ON u.id = o.seller_id "
+        "WHERE r.id = ("
+        "  SELECT id FROM order_ranges WHERE start_number <= ? ORDER BY start_number DESC LIMIT 1"
+        ")",
+        (number,),
+    ).fetchone()
+    if row is None or row["end_number"] < number:
+        return None
+    sale = dict(row)
+    sale["number"] = number
+    return sale
+
+
+def overlapping_ranges(db: sqlite3.Connection, start: int, end: int) -> list[sqlite3.Row]:
+    # At most one range can start before `start` and still overlap it; every
+    # other overlapping range starts inside [start, end].
+    return db.execute(
+        "SELECT start_number, end_number, order_id FROM ("
+        "  SELECT start_number, end_number, order_id FROM order_ranges "
+        "  WHERE start_number < ?1 ORDER BY start_number DESC LIMIT 1"
+        ") WHERE end_number >= ?1 "
+        "UNION ALL "
+        "SELECT start_number, end_number, order_id FROM order_ranges "
+        "WHERE start_number BETWEEN ?1 AND ?2 "
+        "ORDER BY start_number",
+        (start, end),
+    ).fetchall()
+
+
+def first_sold_number(db: sqlite3.Connection, ranges: list[list[int]]) -> int | None:
+    for start, end in ranges:
+        overlaps = overlapping_ranges(db, start, end)
+        if overlaps:
+            return max(start, overlaps[0]["start_number"])
+    return None
+
+
+def create_order(
+    db: sqlite3.Connection,
+    seller_id: int,
+    buyer_name: str,
+    buyer_phone: str,
+    sold_at: str,
+    ranges: list[list[int]],
+) -> int:
+    quantity = sum(end - start + 1 for start, end in ranges)
+    order_id = db.execute(
+        "INSERT INTO orders (seller_id, buyer_name, buyer_phone, sold_at, quantity) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (seller_id, buyer_name, buyer_phone, sold_at, quantity),
+    ).lastrowid
+    db.executemany(
+        "INSERT INTO order_ranges (order_id, start_number, end_number) VALUES (?, ?, ?)",
+        [(order_id, start, end) for start, end in ranges],
+    )
+    return order_id
+
+
+def remove_sold_number(db: sqlite3.Connection, sale: dict, number: int) -> None:
+    # Cut one number out of its range, splitting the range when needed.
+    start, end = sale["start_number"], sale["end_number"]
+    if start == end:
+        db.execute("DELETE FROM order_ranges WHERE id = ?", (sale["range_id"],))
+    elif number == start:
+        db.execute(
+            "UPDATE order_ranges SET start_number = ? WHERE id = ?", (number + 1, sale["range_id"])
+        )
+    elif number == end:
+        db.execute(
+            "UPDATE order_ranges SET end_number = ? WHERE id = ?", (number - 1, sale["range_id"])
+        )
+    else:
+        db.execute(
+            "UPDATE order_ranges SET end_number = ? WHERE id = ?", (number - 1, sale["range_id"])
+        )
+        db.execute(
+            "INSERT INTO order_ranges (order_id, start_number, end_number) VALUES (?, ?, ?)",
+            (sale["order_id"], number + 1, end),
+        )
+    if sale["quantity"] == 1:
+        db.execute("DELETE FROM orders WHERE id = ?", (sale["order_id"],))
+    else:
+        db.execute("UPDATE orders SET quantity = quantity - 1 WHERE id = ?", (sale["order_id"],))
+
+
+def ranges_for_orders(db: sqlite3.Connection, order_ids: list[int]) -> dict[int, list[list[int]]]:
+    ranges: dict[int, list[list[int]]] = {}
+    for chunk in chunked(order_ids):
+        placeholders = ",".join("?" * len(chunk))
+        for row in db.execute(
+            "SELECT order_id, start_number, end_number FROM order_ranges "
+            f"WHERE order_id IN ({placeholders}) ORDER BY start_number",
+            chunk,
+        ):
+            ranges.setdefault(row["order_id"], []).append([row["start_number"], row["end_number"]])
+    return ranges
+
+
+def sales_at_ranks(db: sqlite3.Connection, ranks: list[int]) -> dict[int, dict]:
+    # SQLite sums the sold count of each bucket of numbers (by range start)
+    # with range scans of the covering idx_order_ranges_interval. Python only
+    # walks those totals and the ranges of buckets holding a rank, and orders
+    # are joined for winning ranges only. Buckets widen past DRAW_BUCKET_SIZE
+    # so there are never more than DRAW_MAX_BUCKETS of them.
+    last_start = db.execute("SELECT MAX(start_number) FROM order_ranges").fetchone()[0]
+    if not ranks or last_start is None:
+        return {}
+    bucket_size = max(DRAW_BUCKET_SIZE, last_start // DRAW_MAX_BUCKETS + 1)
+    bucket_totals = db.execute(
+        "WITH RECURSIVE buckets(bucket) AS ("
+        "  SELECT 0 UNION ALL SELECT bucket + 1 FROM buckets WHERE bucket < ?1 / ?2"
+        ") "
+        "SELECT bucket, ("
+        "  SELECT COALESCE(SUM(end_number - start_number + 1), 0) FROM order_ranges "
+        "  WHERE start_number >= bucket * ?2 AND start_number < (bucket + 1) * ?2"
+        ") FROM buckets",
+        (last_start, bucket_size),
+    ).fetchall()
+
+    pending = sorted(ranks)
+    hits: dict[int, tuple[int, int]] = {}
+    offset = 0
+    for bucket, count in bucket_totals:
+        if pending and pending[0] < offset + count:
+            range_offset = offset
+            for range_id, start, end in db.execute(
+                "SELECT id, start_number, end_number FROM order_ranges "
+                "WHERE start_number >= ? AND start_number < ? ORDER BY start_number",
+                (bucket * bucket_size, (bucket + 1) * bucket_size),
+            ):
+                size = end - start + 1
+                while pending and pending[0] < range_offset + size:
+                    rank = pending.pop(0)
+                    hits[rank] = (range_id, start + rank - range_offset)
+                range_offset += size
+        if not pending:
+            break
+        offset += count
+
+    rows: dict[int, sqlite3.Row] = {}
+    for chunk in chunked(sorted({range_id for range_id, _ in hits.values()})):
+        placeholders = ",".join("?" * len(chunk))
+        for row in db.execute(
+            f"SELECT {SALE_COLUMNS} FROM order_ranges r JOIN orders o ON o.id = r.order_id "
+            f"WHERE r.id IN ({placeholders})",
+            chunk,
+        ):
+            rows[row["range_id"]] = row
+
+    found: dict[int, dict] = {}
+    for rank, (range_id, number) in hits.items():
+        sale = dict(rows[range_id])
+        sale["number"] = number
+        found[rank] = sale
+    return found
+
+
+# Streaming helpers
+#
+# Streamed bodies are generated after the request context is gone, so they
+# read through a dedicated connection instead of the per-request one and
+# flush in STREAM_CHUNK_BYTES pieces.
+
+def stream_with_db(database: str, produce) -> Iterator:
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    try:
+        yield from produce(db)
+    finally:
+        db.close()
+
+
+def csv_stream(header: list[str], rows: Iterable[list]) -> Iterator[str]:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() > STREAM_CHUNK_BYTES:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def csv_stream_response(filename: str, header: list[str], rows_for):
+    # `rows_for(db)` yields the CSV rows from the streaming connection.
+    body = stream_with_db(
+        current_app.config["DATABASE"], lambda db: csv_stream(header, rows_for(db))
     )
+    response = current_app.response_class(body, mimetype="text/csv")
+    response.headers["Content-Type"] = "text/csv; charset=utf-8"
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+# Receipt helpers
+#
+# A receipt is every range of one order, or of every order for one buyer
+# phone, fetched by a single query through idx_orders_buyer_phone (or the
+# primary key) and idx_order_ranges_order.
+
+RECEIPT_FORMATS = ("html", "text", "csv")
+
+# CROSS JOIN pins orders as the outer loop so the batch export walks
+# idx_orders_buyer_phone in order and only sorts each order's few ranges,
+# instead of sorting every range up front.
+RECEIPT_QUERY = (
+    "SELECT o.id AS order_id, o.seller_id, o.buyer_name, o.buyer_phone, o.sold_at, o.quantity, "
+    "u.username AS seller_username, r.start_number, r.end_number "
+    "FROM orders o "
+    "CROSS JOIN order_ranges r ON r.order_id = o.id "
+    "JOIN users u ON u.id = o.seller_id "
+)
+
+RECEIPT_CSV_HEADER = [
+    "buyer_name",
+    "buyer_phone",
+    "order_id",
+    "seller",
+    "sold_at",
+    "number_start",
+    "number_end",
+    "quantity",
+]
+
+
+def order_receipt(
+    db: sqlite3.Connection, order_id: int, seller_id: int | None = None
+) -> dict | None:
+    query = RECEIPT_QUERY + "WHERE o.id = ?"
+    params: list = [order_id]
+    if seller_id is not None:
+        query += " AND o.seller_id = ?"
+        params.append(seller_id)
+    return build_receipt(db.execute(query + " ORDER BY r.start_number", params))
+
+
+def buyer_receipt(
+    db: sqlite3.Connection, buyer_phone: str, seller_id: int | None = None
+) -> dict | None:
+    query = RECEIPT_QUERY + "WHERE o.buyer_phone = ?"
+    params: list = [buyer_phone]
+    if seller_id is not None:
+        query += " AND o.seller_id = ?"
+        params.append(seller_id)
+    return build_receipt(db.execute(query + " ORDER BY o.id, r.start_number", params))
+
+
+def iter_buyer_receipts(db: sqlite3.Connection) -> Iterator[dict]:
+    # Streams one receipt per buyer phone; only the current buyer's rows are
+    # held in memory.
+    cursor = db.execute(RECEIPT_QUERY + "ORDER BY o.buyer_phone, o.id, r.start_number")
+    for _, rows in groupby(cursor, key=lambda row: row["buyer_phone"]):
+        yield build_receipt(rows)
+
+
+def build_receipt(rows: Iterable[sqlite3.Row]) -> dict | None:
+    # Rows must be grouped by order with ranges in number order.
+    orders = []
+    for _, order_rows in groupby(rows, key=lambda row: row["order_id"]):
+        order_rows = list(order_rows)
+        first = order_rows[0]
+        orders.append(
+            {
+                "id": first["order_id"],
+                "seller_username": first["seller_username"],
+                "buyer_name": first["buyer_name"],
+                "sold_at": first["sold_at"],
+                "quantity": first["quantity"],
+                "ranges": [[row["start_number"], row["end_number"]] for row in order_rows],
+            }
+        )
+    if not orders:
+        return None
+
+    ranges = merge_ranges(item for order in orders for item in order["ranges"])
+    for order in orders:
+        order["numbers"] = format_range_list(order["ranges"])
+    return {
+        # The latest order carries the most recent spelling of the name.
+        "buyer_name": orders[-1]["buyer_name"],
+        "buyer_phone": first["buyer_phone"],
+        "quantity": sum(order["quantity"] for order in orders),
+        "ranges": ranges,
+        "numbers": format_range_list(ranges),
+        "orders": orders,
+    }
+
+
+RECEIPT_SUMMARY_HEADER = ["buyer_name", "buyer_phone", "orders", "quantity", "numbers"]
+
+
+def receipt_summary_rows(db: sqlite3.Connection) -> Iterator[list]:
+    for receipt in iter_buyer_receipts(db):
+        yield [
+            receipt["buyer_name"],
+            receipt["buyer_phone"],
+            len(receipt["orders"]),
+            receipt["quantity"],
+            receipt["numbers"],
+        ]
+
+
+def receipts_zip_stream(db: sqlite3.Connection) -> Iterator[bytes]:
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for index, receipt in enumerate(iter_buyer_receipts(db), start=1):
+            # The index keeps names unique when two phones only differ in
+            # punctuation.
+            name = f"{index:06d}-{receipt_filename(receipt['buyer_phone'])}.txt"
+            archive.writestr(name, receipt_text(receipt))
+            if buffer.size > STREAM_CHUNK_BYTES:
+                yield buffer.drain()
+    yield buffer.drain()
+
+
+def receipt_text(receipt: dict) -> str:
+    lines = [
+        "Recibo da Rifa",
+        f"Comprador: {receipt['buyer_name']}",
+        f"Telefone: {receipt['buyer_phone']}",
+        f"Quantidade: {receipt['quantity']}",
+        f"Números: {receipt['numbers']}",
+    ]
+    if len(receipt["orders"]) > 1:
+        lines.append("")
+        for order in receipt["orders"]:
+            lines.append(
+                f"Pedido #{order['id']} ({order['sold_at']} UTC, {order['seller_username']}): "
+                f"{order['numbers']}"
+            )
+    else:
+        order = receipt["orders"][0]
+        lines.append(f"Pedido #{order['id']} ({order['sold_at']} UTC, {order['seller_username']})")
+    return "\n".join(lines) + "\n"
+
+
+def receipt_csv_rows(receipt: dict) -> Iterator[list]:
+    for order in receipt["orders"]:
+        for start, end in order["ranges"]:
+            yield [
+                order["buyer_name"],
+                receipt["buyer_phone"],
+                order["id"],
+                order["seller_username"],
+                order["sold_at"],
+                start,
+                end,
+                end - start + 1,
+            ]
+
+
+def receipt_response(receipt: dict, fmt: str, filename: str):
+    if fmt == "text":
+        response = make_response(receipt_text(receipt))
+        response.headers["Content-Type"] = "text/plain; charset=utf-8"
+        response.headers["Content-Disposition"] = f"inline; filename={filename}.txt"
+        return response
+    if fmt == "csv":
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(RECEIPT_CSV_HEADER)
+        writer.writerows(receipt_csv_rows(receipt))
+        response = make_response(output.getvalue())
+        response.headers["Content-Type"] = "text/csv; charset=utf-8"
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}.csv"
+        return response
+    return render_template("receipt.html", receipt=receipt)
+
+
+def receipt_filename(buyer_phone: str) -> str:
+    digits = "".join(char for char in buyer_phone if char.isdigit())
+    return f"recibo-{digits or 'sem-telefone'}"
+
+
+class StreamBuffer(io.RawIOBase):
+    # Write-only sink for zipfile. It is not seekable, so zipfile writes
+    # entries with data descriptors and the caller can drain finished entries
+    # straight into a streamed response.
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: list[bytes] = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+
+# Draw helpers
+
+def draw_ranks(seed: str, total: int, prizes: int) -> list[int]:
+    # Ranks index the sold numbers in ascending order, so anyone holding the
+    # seed and the sales export can reproduce the draw.
+    return random.Random(seed).sample(range(total), prizes)
+
+
+def run_draw(actor_id: int, prizes: int, seed: str | None = None) -> int:
+    # Winners are resolved by rank in a single pass over the order ranges.
+    if prizes < 1 or prizes > MAX_PRIZES:
+        raise ValueError(f"Number of prizes must be between 1 and {MAX_PRIZES}.")
+    seed = seed or secrets.token_hex(16)
+
+    db = get_db()
+    try:
+        begin_write(db)
+        total = db.execute("SELECT COALESCE(SUM(quantity), 0) FROM orders").fetchone()[0]
+        if prizes > total:
+            raise ValueError(f"Only {total} number(s) are sold; cannot draw {prizes} prize(s).")
+
+        now = now_ts()
+        draw_id = db.execute(
+            "INSERT INTO draws (seed, total_sold, prizes, drawn_by, drawn_at) VALUES (?, ?, ?, ?, ?)",
+            (seed, total, prizes, actor_id, now),
+        ).lastrowid
+        ranks = draw_ranks(seed, total, prizes)
+        winners = sales_at_ranks(db, ranks)
+        for position, rank in enumerate(ranks, start=1):
+            winner = winners[rank]
+            db.execute(
+                "INSERT INTO draw_winners "
+                "(draw_id, position, rank, number, seller_id, buyer_name, buyer_phone) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    draw_id,
+                    position,
+                    rank,
+                    winner["number"],
+                    winner["seller_id"],
+                    winner["buyer_name"],
+                    winner["buyer_phone"],
+                ),
+            )
+            log_audit(
+                "draw_winner",
+                actor_id,
+                number=winner["number"],
+                seller_id=winner["seller_id"],
+                details={
+                    "draw_id": draw_id,
+                    "position": position,
+                    "rank": rank,
+                    "seed": seed,
+                    "total_sold": total,
+                    "buyer_name": winner["buyer_name"],
+                    "buyer_phone": winner["buyer_phone"],
+                },
+                db=db,
+            )
+        db.commit()
+    except (ValueError, sqlite3.Error):
+        db.rollback()
+        raise
+    return draw_id
+
+
+# Backup helpers
+
+def backup_database(database: str, backup_dir: str, keep: int | None = BACKUP_KEEP) -> dict:
+    # Copy everything in one backup step. In WAL mode that step only holds a
+    # read snapshot, so sellers keep committing; copying in smaller steps would
+    # restart from page 1 after every commit and never finish under load.
+    os.makedirs(backup_dir, exist_ok=True)
+    started = datetime.utcnow()
+    name = f"{BACKUP_PREFIX}{started.strftime('%Y%m%dT%H%M%S%f')}.db"
+    path = os.path.join(backup_dir, name)
+    partial = f"{path}.partial"
+    pages = 0
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal pages
+        pages = total
+
+    source = sqlite3.connect(database, timeout=DB_BUSY_TIMEOUT)
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target, pages=-1, progress=progress)
+        # Keep the copy self-contained: a WAL file next to it would be needed
+        # to open it read-only.
+        target.execute("PRAGMA journal_mode = DELETE")
+    except sqlite3.Error:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        target.close()
+        source.close()
+
+    integrity = check_integrity(partial)
+    try:
+        if integrity == "ok":
+            # Linking fails instead of overwriting an existing backup.
+            os.link(partial, path)
+    finally:
+        os.remove(partial)
+    finished = datetime.utcnow()
+
+    status = {
+        "name": name if integrity == "ok" else None,
+        "started_at": started.isoformat(timespec="seconds"),
+        "finished_at": finished.isoformat(timespec="seconds"),
+        "duration_seconds": round((finished - started).total_seconds(), 3),
+        "pages": pages,
+        "size_bytes": os.path.getsize(path) if integrity == "ok" else 0,
+        "integrity": integrity,
+    }
+    if integrity == "ok":
+        with open(os.path.join(backup_dir, BACKUP_STATUS_FILE), "w", encoding="utf-8") as handle:
+            json.dump(status, handle)
+        if keep is not None:
+            rotate_backups(backup_dir, keep)
+    return status
+
+
+def check_integrity(path: str) -> str:
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return db.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.DatabaseError as exc:
+        return str(exc)
+    finally:
+        db.close()
+
+
+def list_backups(backup_dir: str) -> list[dict]:
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for entry in os.scandir(backup_dir):
+        if entry.name.startswith(BACKUP_PREFIX) and entry.name.endswith(".db"):
+            backups.append({"name": entry.name, "size_bytes": entry.stat().st_size})
+    # Names embed a sortable UTC timestamp.
+    backups.sort(key=lambda item: item["name"], reverse=True)
+    return backups
+
+
+def rotate_backups(backup_dir: str, keep: int) -> None:
+    for item in list_backups(backup_dir)[max(1, keep) :]:
+        os.remove(os.path.join(backup_dir, item["name"]))
+
+
+def read_backup_status(backup_dir: str) -> dict | None:
+    try:
+        with open(os.path.join(backup_dir, BACKUP_STATUS_FILE), encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def restore_database(backup_path: str, database: str) -> None:
+    # Copying through the backup API takes SQLite's locks on the live file,
+    # unlike a plain file copy that could interleave with open connections.
+    source = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+    target = sqlite3.connect(database, timeout=MIGRATION_LOCK_TIMEOUT)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+# Bulk import helpers
+
+# First-column names that mark a header row, in English or as labelled in the
+# Portuguese upload forms (compared without case or accents).
+SELLER_CSV_HEADERS = {"username", "usuario"}
+SALES_CSV_HEADERS = {"number", "numero"}
+
+
+def is_header_row(row: list[str], names: set[str]) -> bool:
+    if not row:
+        return False
+    decomposed = unicodedata.normalize("NFKD", row[0].strip().lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char)) in names
+
+
+def import_csv_file(importer, csv_path: str, actor_id: int):
+    # CLI counterpart of the upload views: runs `importer(rows, actor_id)`.
+    try:
+        with open(csv_path, "rb") as handle:
+            return importer(read_csv_rows(handle), actor_id)
+    except UnicodeDecodeError:
+        raise click.ClickException("The CSV file must be UTF-8 encoded.")
+    except csv.Error as exc:
+        raise click.ClickException(f"The CSV file could not be read: {exc}")
+
+
+def read_csv_rows(stream) -> Iterator[list[str]]:
+    for row in csv.reader(codecs.iterdecode(stream, "utf-8-sig")):
+        cells = [cell.strip() for cell in row]
+        if any(cells):
+            yield cells
+
+
+def parse_number_list(text: str) -> list[int]:
+    # Accepts numbers and inclusive ranges separated by commas, spaces or
+    # newlines, e.g. "12, 40-45 100".
+    numbers: list[int] = []
+    seen: set[int] = set()
+    for token in text.replace(",", " ").split():
+        start_raw, _, end_raw = token.partition("-")
+        start = parse_int(start_raw, None)
+        end = parse_int(end_raw, None) if end_raw else start
+        if start is None or end is None or start > end:
+            raise ValueError(f"Invalid number or range: {token}")
+        if start < 1 or end > MAX_NUMBER:
+            raise ValueError(f"Numbers must be between 1 and {MAX_NUMBER}.")
+        if len(seen) + (end - start + 1) > MAX_LOOKUP_NUMBERS:
+            raise ValueError(f"Look up at most {MAX_LOOKUP_NUMBERS} numbers at a time.")
+        for number in range(start, end + 1):
+            if number not in seen:
+                seen.add(number)
+                numbers.append(number)
+    return numbers
+
+
+def lookup_numbers(numbers: list[int]) -> list[dict]:
+    # One query resolves the whole batch: json_each turns the list into a set,
+    # each number seeks its candidate order range and reservations are probed
+    # through their unique number index.
+    if not numbers:
+        return []
+    rows = query_all(
+        "SELECT j.value AS number, 'sold' AS status, o.seller_id, u.username AS seller_username, "
+        "o.buyer_name, o.buyer_phone, o.sold_at, NULL AS reserved_until "
+        "FROM json_each(?1) j "
+        "JOIN order_ranges s ON s.id = ("
+        "  SELECT id FROM order_ranges WHERE start_number <= j.value "
+        "  ORDER BY start_number DESC LIMIT 1"
+        ") "
+        "JOIN orders o ON o.id = s.order_id "
+        "JOIN users u ON u.id = o.seller_id "
+        "WHERE s.end_number >= j.value "
+        "UNION ALL "
+        "SELECT r.number, 'reserved', r.seller_id, u.username, NULL, NULL, NULL, r.reserved_until "
+        "FROM reservations r JOIN users u ON u.id = r.seller_id "
+        "WHERE r.number IN (SELECT value FROM json_each(?1))",
+        (json.dumps(numbers),),
+    )
+    found: dict[int, dict] = {}
+    for row in rows:
+        if row["number"] not in found or row["status"] == "sold":
+            found[row["number"]] = dict(row)
+    return [
+        found.get(number)
+        or {
+            "number": number,
+            "status": "available",
+            "seller_id": None,
+            "seller_username": None,
+            "buyer_name": None,
+            "buyer_phone": None,
+            "sold_at": None,
+            "reserved_until": None,
+        }
+        for number in numbers
+    ]
+
+
+def chunked(items: Iterable, size: int = SQL_CHUNK_SIZE) -> Iterator[list]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def number_ranges(numbers: Iterable[int]) -> list[list[int]]:
+    return merge_ranges([number, number] for number in numbers)
+
+
+def merge_ranges(ranges: Iterable[list[int]]) -> list[list[int]]:
+    merged: list[list[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def bitmap_ranges(bitmap: bytearray) -> Iterator[list[int]]:
+    # Ranges of set positions, found with C-level scans instead of a Python
+    # loop over every number.
+    position = bitmap.find(1)
+    while position != -1:
+        end = bitmap.find(0, position)
+        if end == -1:
+            end = len(bitmap)
+        yield [position, end - 1]
+        position = bitmap.find(1, end)
+
+
+def format_ranges(numbers: Iterable[int]) -> str:
+    return format_range_list(number_ranges(numbers))
+
+
+def format_range_list(ranges: Iterable[list[int]]) -> str:
+    return ", ".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def import_sellers(rows: Iterable[list[str]], actor_id: int) -> list[dict]:
+    # Rows are "username[,password]"; missing passwords are generated and
+    # invalid rows are reported back instead of aborting the whole import.
+    results: list[dict] = []
+    seen: set[str] = set()
+    for index, row in enumerate(rows):
+        username = row[0] if row else ""
+        password = row[1] if len(row) > 1 else ""
+        if index == 0 and is_header_row(row, SELLER_CSV_HEADERS):
+            continue
+
+        item = {"username": username, "password": "", "status": "created"}
+        if not username:
+            item["status"] = "Username is required."
+        elif username in seen:
+            item["status"] = "Duplicate username in file."
+        elif password and len(password) < MIN_PASSWORD_LENGTH:
+            item["status"] = f"Password should be at least {MIN_PASSWORD_LENGTH} characters."
+        else:
+            item["password"] = password or secrets.token_urlsafe(9)
+            seen.add(username)
+        results.append(item)
+
+    db = get_db()
+    pending = [item for item in results if item["status"] == "created"]
+    existing: set[str] = set()
+    for chunk in chunked([item["username"] for item in pending]):
+        placeholders = ",".join("?" * len(chunk))
+        existing.update(
+            row["username"]
+            for row in db.execute(
+                f"SELECT username FROM users WHERE username IN ({placeholders})", chunk
+            )
+        )
+    for item in pending:
+        if item["username"] in existing:
+            item["status"] = "Username already exists."
+            item["password"] = ""
+    pending = [item for item in pending if item["status"] == "created"]
+    if not pending:
+        return results
+
+    # Password hashing dominates the cost and releases the GIL, so spread it
+    # across threads before taking the write slot.
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        hashes = list(pool.map(generate_password_hash, [item["password"] for item in pending]))
+
+    now = now_ts()
+    with current_app.extensions["write_scheduler"].slot():
+        try:
+            begin_write(db)
+            db.executemany(
+                "INSERT INTO users (username, password_hash, role, created_at) "
+                "VALUES (?, ?, 'seller', ?)",
+                [
+                    (item["username"], password_hash, now)
+                    for item, password_hash in zip(pending, hashes)
+                ],
+            )
+            log_audit(
+                "seller_create",
+                actor_id,
+                details={
+                    "count": len(pending),
+                    "usernames": [item["username"] for item in pending],
+                    "source": "csv_import",
+                },
+                db=db,
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            current_app.extensions["aggregate_cache"].invalidate()
+    return results
+
+
+def import_sales(rows: Iterable[list[str]], actor_id: int) -> tuple[int, list[dict]]:
+    # Rows are "number,buyer_name,buyer_phone,seller_username". The file is
+    # validated in chunks into a TEMP staging table before the write slot is
+    # taken, so uploads never hold up sellers' sales and memory stays bounded
+    # by the chunk size plus the number bitmap. Staged rows are then checked
+    # against orders/reservations a chunk at a time, with one query per table
+    # instead of one lookup per number. Rows for the same seller and buyer
+    # become one order holding their number ranges.
+    db = get_db()
+    sellers = {
+        row["username"]: row["id"]
+        for row in db.execute("SELECT id, username FROM users WHERE role = 'seller'")
+    }
+    seen = bytearray(MAX_NUMBER + 1)
+    imported = 0
+    conflicts: list[dict] = []
+    orders: dict[tuple[int, str, str], int] = {}
+
+    def conflict(line: int, row: list[str], reason: str) -> None:
+        conflicts.append(
+            {
+                "row": line,
+                "number": row[0] if row else "",
+                "buyer_name": row[1] if len(row) > 1 else "",
+                "seller": row[3] if len(row) > 3 else "",
+                "reason": reason,
+            }
+        )
+
+    db.execute("DROP TABLE IF EXISTS temp.sales_import")
+    db.execute(
+        "CREATE TEMP TABLE sales_import ("
+        "  line INTEGER PRIMARY KEY, number INTEGER NOT NULL, buyer_name TEXT NOT NULL, "
+        "  buyer_phone TEXT NOT NULL, seller TEXT NOT NULL, seller_id INTEGER NOT NULL"
+        ")"
+    )
+    try:
+        for chunk in chunked(enumerate(rows, start=1)):
+            staged = []
+            for line, row in chunk:
+                if line == 1 and is_header_row(row, SALES_CSV_HEADERS):
+                    continue
+                if len(row) < 4:
+                    conflict(line, row, "Expected number, buyer name, buyer phone and seller.")
+                    continue
+                number = parse_int(row[0], None)
+                buyer_name, buyer_phone, seller = row[1], row[2], row[3]
+                if number is None:
+                    conflict(line, row, "Invalid number.")
+                elif number < 1 or number > MAX_NUMBER:
+                    conflict(line, row, "Number is out of range.")
+                elif not buyer_name or not buyer_phone:
+                    conflict(line, row, "Buyer name and phone are required.")
+                elif seller not in sellers:
+                    conflict(line, row, "Seller not found.")
+                elif seen[number]:
+                    conflict(line, row, "Duplicate number in file.")
+                else:
+                    seen[number] = 1
+                    staged.append((line, number, buyer_name, buyer_phone, seller, sellers[seller]))
+            db.executemany("INSERT INTO temp.sales_import VALUES (?, ?, ?, ?, ?, ?)", staged)
+        # Only the TEMP table was written; end the implicit transaction so
+        # BEGIN IMMEDIATE can start a fresh one.
+        db.commit()
+
+        now = now_ts()
+        with current_app.extensions["write_scheduler"].slot():
+            try:
+                begin_write(db)
+                # A seller may have been deleted since the file was parsed.
+                live_sellers = {
+                    row["id"] for row in db.execute("SELECT id FROM users WHERE role = 'seller'")
+                }
+                last_line = 0
+                while True:
+                    chunk = db.execute(
+                        "SELECT line, number, buyer_name, buyer_phone, seller, seller_id "
+                        "FROM temp.sales_import WHERE line > ? ORDER BY line LIMIT ?",
+                        (last_line, SQL_CHUNK_SIZE),
+                    ).fetchall()
+                    if not chunk:
+                        break
+                    last_line = chunk[-1]["line"]
+
+                    numbers = [item["number"] for item in chunk]
+                    placeholders = ",".join("?" * len(numbers))
+                    sold = {
+                        row["number"]
+                        for row in db.execute(
+                            "SELECT j.value AS number FROM json_each(?) j "
+                            "WHERE ("
+                            "  SELECT end_number FROM order_ranges WHERE start_number <= j.value "
+                            "  ORDER BY start_number DESC LIMIT 1"
+                            ") >= j.value",
+                            (json.dumps(numbers),),
+                        )
+                    }
+                    reserved = {
+                        row["number"]: row["seller_id"]
+                        for row in db.execute(
+                            "SELECT number, seller_id FROM reservations "
+                            f"WHERE number IN ({placeholders})",
+                            numbers,
+                        )
+                    }
+
+                    valid = []
+                    for item in chunk:
+                        line, number, seller_id = item["line"], item["number"], item["seller_id"]
+                        row = [str(number), item["buyer_name"], item["buyer_phone"], item["seller"]]
+                        if seller_id not in live_sellers:
+                            conflict(line, row, "Seller not found.")
+                        elif number in sold:
+                            conflict(line, row, "Number is already sold.")
+                        elif reserved.get(number, seller_id) != seller_id:
+                            conflict(line, row, "Number is reserved by another seller.")
+                        else:
+                            valid.append((number, seller_id, item["buyer_name"], item["buyer_phone"]))
+                            continue
+                        # `seen` ends up holding exactly the imported numbers.
+                        seen[number] = 0
+                    if not valid:
+                        continue
+
+                    by_buyer: dict[tuple[int, str, str], list[int]] = {}
+                    for number, seller_id, buyer_name, buyer_phone in valid:
+                        by_buyer.setdefault((seller_id, buyer_name, buyer_phone), []).append(number)
+                    for key, buyer_numbers in by_buyer.items():
+                        ranges = number_ranges(buyer_numbers)
+                        if key in orders:
+                            db.executemany(
+                                "INSERT INTO order_ranges (order_id, start_number, end_number) "
+                                "VALUES (?, ?, ?)",
+                                [(orders[key], start, end) for start, end in ranges],
+                            )
+                            db.execute(
+                                "UPDATE orders SET quantity = quantity + ? WHERE id = ?",
+                                (len(buyer_numbers), orders[key]),
+                            )
+                        else:
+                            orders[key] = create_order(db, *key, now, ranges)
+                    consumed = [(item[0],) for item in valid if item[0] in reserved]
+                    if consumed:
+                        db.executemany("DELETE FROM reservations WHERE number = ?", consumed)
+                    imported += len(valid)
+                    for seller_id, count in Counter(item[1] for item in valid).items():
+                        record_activity(db, seller_id, now, sales=count)
+
+                if imported:
+                    log_audit(
+                        "sale_import",
+                        actor_id,
+                        details={
+                            "count": imported,
+                            "orders": len(orders),
+                            "conflicts": len(conflicts),
+                            "numbers": format_range_list(bitmap_ranges(seen)),
+                            "sold_at": now,
+                            "source": "csv_import",
+                        },
+                        db=db,
+                    )
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                current_app.extensions["aggregate_cache"].invalidate()
+    finally:
+        db.rollback()
+        db.execute("DROP TABLE IF EXISTS temp.sales_import")
+    conflicts.sort(key=lambda item: item["row"])
+    return imported, conflicts
+
+
+def sales_conflicts_csv(conflicts: list[dict]) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["row", "number", "buyer_name", "seller", "reason"])
+    for item in conflicts:
+        writer.writerow(
+            [item["row"], item["number"], item["buyer_name"], item["seller"], item["reason"]]
+        )
+    return output.getvalue()
+
+
+def seller_credentials_csv(results: list[dict]) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["username", "password", "status"])
+    for item in results:
+        writer.writerow([item["username"], item["password"], item["status"]])
+    return output.getvalue()
 
 
 def parse_int(value, default):
@@ -648,6 +648,65 @@
     syncSearchToggles();
   }
 
+  const velocityChart = document.getElementById("velocity-chart");
+  if (velocityChart) {
+    const velocityHours = document.getElementById("velocity-hours");
+    const velocitySummary = document.getElementById("velocity-summary");
+
+    const renderVelocity = (series) => {
+      const peak = Math.max(1, ...series.map((item) => item.sales + item.reservations));
+      velocityChart.replaceChildren();
+      let totalSales = 0;
+      let totalVoids = 0;
+      let totalReservations = 0;
+      series.forEach((item) => {
+        totalSales += item.sales;
+        totalVoids += item.voids;
+        totalReservations += item.reservations;
+        const column = document.createElement("div");
+        column.className = "velocity-column";
+        column.title =
+          `${item.hour} | vendas: ${item.sales} | ` +
+          `cancelamentos: ${item.voids} | reservas: ${item.reservations}`;
+        const reserved = document.createElement("div");
+        reserved.className = "velocity-bar is-reserved";
+        reserved.style.height = `${(item.reservations / peak) * 100}%`;
+        const sold = document.createElement("div");
+        sold.className = "velocity-bar is-sold";
+        sold.style.height = `${(item.sales / peak) * 100}%`;
+        column.append(reserved, sold);
+        velocityChart.append(column);
+      });
+      if (velocitySummary) {
+        velocitySummary.textContent =
+          `Vendas: ${totalSales} | Cancelamentos: ${totalVoids} | Reservas: ${totalReservations}`;
+      }
+    };
+
+    const loadVelocity = () => {
+      const url = new URL(velocityChart.dataset.url, window.location.origin);
+      if (velocityHours) {
+        url.searchParams.set("hours", velocityHours.value);
+      }
+      fetch(url, { credentials: "same-origin" })
+        .then((response) => (response.ok ? response.json() : null))
+        .then((payload) => {
+          if (payload) {
+            renderVelocity(payload.series);
+          }
+        })
+        .catch(() => {
+          // Keep the last rendered chart on network errors.
+        });
+    };
+
+    if (velocityHours) {
+      velocityHours.addEventListener("change", loadVelocity);
+    }
+    loadVelocity();
+    window.setInterval(loadVelocity, 60000);
+  }
+
   const modal = document.getElementById("confirm-modal");
   if (modal) {
     const modalForm = document.getElementById("confirm-form");